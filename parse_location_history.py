@@ -20,19 +20,75 @@ Google ロケーション履歴 JSON パーサー
 
   # Step 5: 分割（Dawarich等の5MB制限対策）
   python parse_location_history.py split <file.json> -o chunks/ --max-mb 4
+  python parse_location_history.py split <file.json> -o chunks/ --gzip   # chunk_XXXX.json.gz
+
+  # 分割したチャンクを全コアで並列に変換・集計
+  python parse_location_history.py to_csv --from-chunks chunks/ -o locations.csv
+  python parse_location_history.py stats --from-chunks chunks/
 """
 
+import io
 import json
+import mmap
+import multiprocessing
+import re
 import sys
 import os
 import argparse
 import csv
-from datetime import datetime, timezone
-from collections import Counter
+import gzip
+import shutil
+import tempfile
+import zlib
+from datetime import datetime, timedelta, timezone
+from collections import Counter, deque
 from pathlib import Path
 
+try:
+    import orjson
+    HAS_ORJSON = True
+except ImportError:
+    HAS_ORJSON = False
+
+try:
+    import numpy as np
+    HAS_NUMPY = True
+except ImportError:
+    HAS_NUMPY = False
+
+try:
+    # yajl2_c バックエンドがあれば自動的に選択される
+    import ijson
+    from ijson.common import ObjectBuilder
+    HAS_IJSON = True
+except ImportError:
+    HAS_IJSON = False
+
+
+# ロケーションエントリを含むトップレベルの配列キー
+LOCATION_KEYS = ("locations", "semanticSegments", "rawSignals", "timelineObjects", "Records")
+
+# このサイズ以上はijsonで逐次パースする
+STREAMING_THRESHOLD_MB = 500
+
+# 一括読み込み時、このサイズを超えるファイルはmmapして読む
+MMAP_THRESHOLD_MB = 100
 
-# ---- ストリーミングパーサー (ijsonなしで動く簡易版) ----
+# CSVの列 (D1の locations テーブルと同じ並び)
+CSV_COLUMNS = ["timestamp", "lat", "lon", "accuracy", "source", "place_id", "semantic_type", "activity_type", "altitude", "speed"]
+
+# 列バッファ・旧形式 (latitudeE7) のバッファをまとめて処理する件数
+BATCH_SIZE = 65536
+
+# CSV出力の書き込みバッファ
+WRITE_BUFFER_BYTES = 1 << 20
+
+# UNIXエポックからのナノ秒 (int64) でタイムスタンプを扱うときの番兵
+NO_TIMESTAMP_NS = -(2 ** 63)  # タイムスタンプなし (期間フィルタの対象外)
+MAX_TIMESTAMP_NS = 2 ** 63 - 1
+
+
+# ---- ストリーミングパーサー ----
 
 def load_json_streaming(filepath: str):
     """
@@ -45,67 +101,249 @@ def load_json_streaming(filepath: str):
 
     if size_mb > 2000:
         print("⚠️  2GB超のファイルです。メモリ不足になる可能性があります。")
+        print("   ijson をインストールすると逐次パースに切り替わります (pip install ijson)。")
         print("   --after/--before で期間を絞るか、split コマンドの利用を検討してください。")
 
     print("📖 JSONを読み込み中...")
-    with open(filepath, "r", encoding="utf-8") as f:
-        data = json.load(f)
+    if HAS_ORJSON and size_mb > MMAP_THRESHOLD_MB:
+        # 大きいファイルはmmapしてページキャッシュを直接パースする (bytesへのコピーを作らない)
+        data = _load_json_mmap(filepath)
+    elif HAS_ORJSON:
+        # orjsonはbytesを直接受け取るのでバイナリで読む
+        with open(filepath, "rb") as f:
+            data = orjson.loads(f.read())
+    else:
+        with open(filepath, "r", encoding="utf-8") as f:
+            data = json.load(f)
     print("✅ 読み込み完了")
     return data
 
 
-def find_location_entries(data) -> list:
+def _load_json_mmap(filepath: str):
+    """ファイルをmmapしてorjsonでパースする"""
+    fd = os.open(filepath, os.O_RDONLY)
+    try:
+        if hasattr(os, "posix_fadvise"):
+            # 先頭から順に読むので先読みを多めにしてもらう
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        with mmap.mmap(fd, 0, access=mmap.ACCESS_READ) as mm:
+            with memoryview(mm) as buf:
+                return orjson.loads(buf)
+    finally:
+        os.close(fd)
+
+
+# トップレベルのキーと値の先頭の1文字 ({ / [ の直後から)
+_TOP_KEY_RE = re.compile(rb'\s*("(?:[^"\\]|\\.)*")\s*:\s*(\S)')
+
+
+class _TopLevelValueReader:
     """
-    Google Timeline JSONの様々なフォーマットに対応してロケーションエントリを抽出。
-    2024年以降の新形式と旧形式の両方をサポート。
-    semanticSegmentsはvisit/activity/timelinePathを含む複合エントリ。
+    mmap の start:end にある "キー": 値 を {"キー": 値} として読ませるファイル風オブジェクト。
+    ijson.items にそのまま渡せるので、対象の配列以外の部分は読まずに済む。
+    """
+
+    def __init__(self, mm, start: int, end: int):
+        self.mm = mm
+        self.pos = start
+        self.end = end
+        self.head = b"{"
+        self.tail = b"}"
+
+    def read(self, size: int = -1) -> bytes:
+        # ijson は最初に read(0) で bytes か str かを確かめる
+        if size == 0:
+            return b""
+        if self.head:
+            head, self.head = self.head, b""
+            return head
+        if self.pos < self.end:
+            stop = self.end if size < 0 else min(self.pos + size, self.end)
+            chunk = self.mm[self.pos:stop]
+            self.pos = stop
+            return chunk
+        tail, self.tail = self.tail, b""
+        return tail
+
+
+def _top_level_layout(mm) -> list[tuple[str, bool, int, int]] | None:
+    """
+    トップレベルの (キー, 値が配列か, "キー": 値 の開始位置, 終了位置) を出現順に返す。
+    トップレベルがリストなら None。
+    構造文字の走査で深さ1の区切りだけを見るので、値の中身はパースしない。
+    """
+    if mm[:4096].lstrip()[:1] != b"{":
+        return None
+    layout = []
+    # ルートの { とキー同士の区切りのカンマの直後にキーがあり、次の区切りの手前までがその値
+    for pos, char, depth in _scan_structure(mm, 1):
+        if layout and layout[-1][3] is None:
+            layout[-1][3] = pos
+        if depth == 1:
+            m = _TOP_KEY_RE.match(mm, pos + 1)
+            if m:
+                layout.append([json.loads(m.group(1)), m.group(2) == b"[", pos + 1, None])
+    return [tuple(entry) for entry in layout if entry[3] is not None]
+
+
+def _iter_items_ijson(filepath: str, top_keys: list):
+    """
+    トップレベル配列の要素を ijson.items (yajl2_c ならC実装) で1つずつ返す。
+    先にトップレベルのキーの位置を調べ、対象の配列の範囲だけを ijson に読ませる。
+    ファイル全体をメモリに載せないので、巨大なファイルでも一定のメモリで動く。
     """
-    entries = []
+    with open(filepath, "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            layout = _top_level_layout(mm)
+            if layout is None:
+                yield from ((None, item) for item in ijson.items(f, "item", use_float=True))
+                return
+
+            top_keys.extend(key for key, *_ in layout)
+            for key, is_array, start, end in layout:
+                if is_array and key in LOCATION_KEYS:
+                    reader = _TopLevelValueReader(mm, start, end)
+                    for item in ijson.items(reader, f"{key}.item", use_float=True):
+                        yield key, item
+
+
+def _iter_items_ijson_events(f, top_keys: list):
+    """
+    ijsonのイベント列からトップレベル配列の要素を1つずつ組み立てる (NumPyがない場合)。
+    ファイル全体をメモリに載せないので、巨大なファイルでも一定のメモリで動く。
+    """
+    item_prefixes = {f"{k}.item": k for k in LOCATION_KEYS}
+    item_prefixes["item"] = None  # トップレベルがリストの場合
+    builder = None
+    item_prefix = None
+
+    for prefix, event, value in ijson.parse(f, use_float=True):
+        if builder is not None:
+            builder.event(event, value)
+            if prefix == item_prefix and (event == "end_map" or event == "end_array"):
+                yield item_prefixes[item_prefix], builder.value
+                builder = None
+            continue
+
+        if prefix in item_prefixes:
+            if event == "start_map" or event == "start_array":
+                builder = ObjectBuilder()
+                builder.event(event, value)
+                item_prefix = prefix
+            else:
+                yield item_prefixes[prefix], value
+        elif prefix == "" and event == "map_key":
+            top_keys.append(value)
+
+
+def iter_top_level_items(filepath: str, top_keys: list | None = None):
+    """
+    トップレベル配列 (locations / semanticSegments / ...) の要素を
+    (キー, 要素) のタプルで順に返す。トップレベルがリストの場合キーは None。
+    top_keys を渡すと、見つかったトップレベルのキーが追記される。
+    """
+    if top_keys is None:
+        top_keys = []
 
+    size_mb = os.path.getsize(filepath) / (1024 * 1024)
+    if HAS_IJSON and size_mb >= STREAMING_THRESHOLD_MB:
+        print(f"📁 ファイルサイズ: {size_mb:.1f} MB")
+        print("📖 JSONを逐次パース中 (ijson)...")
+        if HAS_NUMPY:
+            yield from _iter_items_ijson(filepath, top_keys)
+        else:
+            with open(filepath, "rb") as f:
+                yield from _iter_items_ijson_events(f, top_keys)
+        return
+
+    data = load_json_streaming(filepath)
     if isinstance(data, dict):
-        # 旧形式: {"locations": [...]}
-        if "locations" in data:
-            return data["locations"]
-
-        # 新形式: {"semanticSegments": [...]}
-        # semanticSegmentsを展開: timelinePathの各pointも個別エントリに
-        if "semanticSegments" in data:
-            for seg in data["semanticSegments"]:
-                if "visit" in seg:
-                    entries.append(seg)
-                elif "activity" in seg:
-                    entries.append(seg)
-                elif "timelinePath" in seg:
-                    # timelinePathの各ポイントを個別エントリとして展開
-                    for pt in seg["timelinePath"]:
-                        entries.append({"_type": "pathPoint", **pt})
-                else:
-                    entries.append(seg)
+        top_keys.extend(data.keys())
+        for key, value in data.items():
+            if key in LOCATION_KEYS and isinstance(value, list):
+                for item in value:
+                    yield key, item
+    elif isinstance(data, list):
+        for item in data:
+            yield None, item
+
+
+def expand_item(key: str | None, item):
+    """
+    トップレベル配列の1要素をロケーションエントリに展開。
+    semanticSegmentsはvisit/activity/timelinePathを含む複合エントリ。
+    """
+    # 新形式: {"semanticSegments": [...]}
+    # semanticSegmentsを展開: timelinePathの各pointも個別エントリに
+    if key == "semanticSegments":
+        if "visit" in item or "activity" in item or "timelinePath" not in item:
+            yield item
+        else:
+            # timelinePathの各ポイントを個別エントリとして展開
+            for pt in item["timelinePath"]:
+                yield {"_type": "pathPoint", **pt}
+
+    # rawSignals からも位置情報を取れる場合がある
+    elif key == "rawSignals":
+        if "position" in item:
+            yield {"_type": "rawPosition", **item["position"]}
+
+    # 旧形式 locations / timelineObjects / Records.json / リスト直接
+    else:
+        yield item
+
+
+def iter_location_entries(filepath: str):
+    """
+    Google Timeline JSONの様々なフォーマットに対応してロケーションエントリを1件ずつ返す。
+    2024年以降の新形式と旧形式の両方をサポート。
+    """
+    top_keys = []
+    found = False
+    for key, item in iter_top_level_items(filepath, top_keys):
+        for entry in expand_item(key, item):
+            found = True
+            yield entry
 
-        # rawSignals からも位置情報を取れる場合がある
-        if "rawSignals" in data:
-            for sig in data["rawSignals"]:
-                if "position" in sig:
-                    pos = sig["position"]
-                    entries.append({"_type": "rawPosition", **pos})
+    if not found and top_keys:
+        warn_unknown_structure(top_keys)
 
-        if entries:
-            return entries
 
-        # 新形式: {"timelineObjects": [...]}
-        if "timelineObjects" in data:
-            return data["timelineObjects"]
+def warn_unknown_structure(top_keys: list):
+    print(f"⚠️  認識できないJSON構造です。トップレベルのキー: {top_keys}")
 
-        # Records.json 形式
-        if "Records" in data:
-            return data["Records"]
 
-    # リスト直接の場合
-    if isinstance(data, list):
-        return data
+def _chunk_files(chunk_dir: Path) -> tuple[list[Path], list[Path]]:
+    """ディレクトリ内の split のチャンクファイルを (.json, .json.gz) に分けて番号順に返す"""
+    return sorted(chunk_dir.glob("chunk_*.json")), sorted(chunk_dir.glob("chunk_*.json.gz"))
 
-    print(f"⚠️  認識できないJSON構造です。トップレベルのキー: {list(data.keys()) if isinstance(data, dict) else type(data)}")
-    return []
+
+def list_chunks(chunk_dir: str) -> list[Path]:
+    """split で作ったチャンクファイル (.json / .json.gz) を番号順に返す"""
+    chunk_dir = Path(chunk_dir)
+    plain, gzipped = _chunk_files(chunk_dir)
+    if plain and gzipped:
+        # 圧縮あり・なしで split し直した残りが混ざっていると同じエントリを二重に数えてしまう
+        print(f"❌ {chunk_dir} に chunk_*.json と chunk_*.json.gz が混在しています。どちらかを削除してください。")
+        sys.exit(1)
+    chunks = plain or gzipped
+    if not chunks:
+        print(f"⚠️  {chunk_dir} にチャンクファイル (chunk_*.json / chunk_*.json.gz) が見つかりません。")
+    return chunks
+
+
+def iter_chunk_entries(chunk_path: Path):
+    """
+    チャンクファイルのロケーションエントリを1件ずつ返す。
+    並列処理のワーカーから呼ぶので、読み込みのメッセージは出さない。
+    """
+    with (gzip.open if chunk_path.suffix == ".gz" else open)(chunk_path, "rb") as f:
+        raw = f.read()
+    data = orjson.loads(raw) if HAS_ORJSON else json.loads(raw)
+    for key, value in data.items():
+        if key in LOCATION_KEYS and isinstance(value, list):
+            for item in value:
+                yield from expand_item(key, item)
 
 
 def parse_latlng(s: str) -> tuple[float, float] | None:
@@ -117,114 +355,304 @@ def parse_latlng(s: str) -> tuple[float, float] | None:
     """
     if not s:
         return None
-    # 度数記号とgeo:プレフィックスを除去
-    cleaned = s.replace("°", "").replace("geo:", "").strip()
-    parts = [p.strip() for p in cleaned.split(",")]
-    if len(parts) == 2:
-        try:
-            return float(parts[0]), float(parts[1])
-        except ValueError:
-            pass
-    return None
+    # 中間文字列を作らないよう、カンマで1回だけ分割して両端の記号を落とす
+    lat, _, lon = s.partition(",")
+    try:
+        return float(lat.strip(" °").removeprefix("geo:")), float(lon.strip(" °"))
+    except ValueError:
+        return None
+
+
+def new_columns() -> dict[str, list]:
+    """extract_into 用の列バッファ (キーの順序はCSVの列順)"""
+    return {name: [] for name in CSV_COLUMNS}
+
+
+def _append_point(cols: dict[str, list], timestamp, lat, lon, accuracy, source,
+                  place_id=None, semantic_type=None, activity_type=None, altitude=None, speed=None):
+    """列バッファに1件分の値を追加"""
+    cols["timestamp"].append(timestamp)
+    cols["lat"].append(lat)
+    cols["lon"].append(lon)
+    cols["accuracy"].append(accuracy)
+    cols["source"].append(source)
+    cols["place_id"].append(place_id)
+    cols["semantic_type"].append(semantic_type)
+    cols["activity_type"].append(activity_type)
+    cols["altitude"].append(altitude)
+    cols["speed"].append(speed)
+
+
+def _extract_records(entry: dict, cols: dict[str, list]) -> bool:
+    """旧形式 (Records.json / locations)"""
+    _append_point(
+        cols,
+        entry.get("timestamp") or entry.get("timestampMs"),
+        entry["latitudeE7"] / 1e7,
+        entry["longitudeE7"] / 1e7,
+        entry.get("accuracy"),
+        entry.get("source", ""),
+    )
+    return True
+
+
+def _extract_path_point(entry: dict, cols: dict[str, list]) -> bool:
+    """timelinePath の個別ポイント"""
+    coords = parse_latlng(entry.get("point", ""))
+    if not coords:
+        return False
+    _append_point(cols, entry.get("time"), coords[0], coords[1], None, "path")
+    return True
+
+
+def _extract_raw_position(entry: dict, cols: dict[str, list]) -> bool:
+    """rawSignals の position"""
+    # LatLng 文字列形式 ("31.589°, 130.551°")
+    if "LatLng" in entry:
+        coords = parse_latlng(entry["LatLng"])
+        if not coords:
+            return False
+        lat, lon = coords
+    # lat/lng 数値形式 (別のエクスポート形式)
+    elif "lat" in entry or "latE7" in entry:
+        lat = entry.get("lat") or entry.get("latE7", 0) / 1e7
+        lon = entry.get("lng") or entry.get("lngE7", 0) / 1e7
+    else:
+        return False
+
+    _append_point(
+        cols,
+        entry.get("timestamp"),
+        lat,
+        lon,
+        entry.get("accuracyMeters"),
+        f"raw:{entry.get('source', '')}",
+        altitude=entry.get("altitudeMeters"),
+        speed=entry.get("speedMetersPerSecond"),
+    )
+    return True
+
+
+def _extract_visit(entry: dict, cols: dict[str, list]) -> bool:
+    """新形式: visit"""
+    visit = entry["visit"]
+    top = visit.get("topCandidate", {})
+    place_loc = top.get("placeLocation", {})
+    coords = parse_latlng(place_loc.get("latLng", ""))
+    if not coords:
+        return False
+    _append_point(
+        cols,
+        entry.get("startTime") or entry.get("endTime"),
+        coords[0],
+        coords[1],
+        None,
+        "visit",
+        place_id=top.get("placeId", ""),
+        semantic_type=top.get("semanticType", ""),
+    )
+    return True
+
+
+def _extract_activity(entry: dict, cols: dict[str, list]) -> bool:
+    """新形式: activity (移動)"""
+    activity = entry["activity"]
+    start = activity.get("start", "")
+    # start地点を使う
+    if isinstance(start, str):
+        coords = parse_latlng(start)
+    elif isinstance(start, dict):
+        coords = parse_latlng(start.get("latLng", ""))
+    else:
+        coords = None
+    if not coords:
+        return False
+    _append_point(
+        cols,
+        entry.get("startTime"),
+        coords[0],
+        coords[1],
+        None,
+        "activity",
+        activity_type=activity.get("topCandidate", {}).get("type", ""),
+    )
+    return True
+
 
+def _extract_timeline_point(entry: dict, cols: dict[str, list]) -> bool:
+    """新形式: timelinePoint"""
+    tp = entry["timelinePoint"]
+    lat = tp.get("latE7", 0) / 1e7 if "latE7" in tp else tp.get("lat")
+    lon = tp.get("lngE7", 0) / 1e7 if "lngE7" in tp else tp.get("lng")
+    if not lat:
+        return False
+    _append_point(cols, tp.get("timestamp"), lat, lon, tp.get("accuracy"), "timelinePoint")
+    return True
 
-def extract_location_point(entry: dict) -> dict | None:
+
+# expand_item で付けた _type → 抽出関数
+_TYPE_DISPATCH = {
+    "pathPoint": _extract_path_point,
+    "rawPosition": _extract_raw_position,
+}
+
+# 新形式のセグメントを見分けるキー → 抽出関数
+_KEY_DISPATCH = {
+    "visit": _extract_visit,
+    "activity": _extract_activity,
+    "timelinePoint": _extract_timeline_point,
+}
+
+
+def extract_into(entry: dict, cols: dict[str, list]) -> bool:
     """
-    各エントリから緯度・経度・タイムスタンプを抽出。
-    複数のJSON形式に対応。
+    各エントリから緯度・経度・タイムスタンプを抽出して列バッファに追加。
+    複数のJSON形式に対応。抽出できなかった場合は何も追加せず False を返す。
     """
-    result = {}
-
-    # --- 旧形式 (Records.json / locations) ---
+    # 旧形式は activity キーを持つことがあるので先に判定する
     if "latitudeE7" in entry:
-        result["lat"] = entry["latitudeE7"] / 1e7
-        result["lon"] = entry["longitudeE7"] / 1e7
-        result["timestamp"] = entry.get("timestamp") or entry.get("timestampMs")
-        result["accuracy"] = entry.get("accuracy")
-        result["source"] = entry.get("source", "")
-        return result
-
-    # --- timelinePath の個別ポイント ---
-    if entry.get("_type") == "pathPoint":
-        coords = parse_latlng(entry.get("point", ""))
-        if coords:
-            result["lat"], result["lon"] = coords
-            result["timestamp"] = entry.get("time")
-            result["accuracy"] = None
-            result["source"] = "path"
-            return result
+        return _extract_records(entry, cols)
+
+    handler = _TYPE_DISPATCH.get(entry.get("_type"))
+    if handler is None:
+        # 新形式はエントリのキーから最初に見つかった種類で処理する
+        for key in entry:
+            handler = _KEY_DISPATCH.get(key)
+            if handler is not None:
+                break
+        else:
+            return False
+    return handler(entry, cols)
+
+
+def _tz_from_offset(offset: str) -> timezone:
+    """"+09:00" / "+0900" 形式のオフセットからtzinfoを作る"""
+    if not (offset[1:3] + offset[-2:]).isdigit() or int(offset[-2:]) >= 60:
+        raise ValueError(f"invalid UTC offset: {offset}")
+    sign = -1 if offset[0] == "-" else 1
+    return timezone(sign * timedelta(hours=int(offset[1:3]), minutes=int(offset[-2:])))
+
+
+# タイムスタンプ末尾のタイムゾーン表記 → tzinfo
+# よく出るもの (UTC/JST) は事前に用意し、それ以外は初出時に作って登録する
+_JST = timezone(timedelta(hours=9))
+_TZ = {
+    "": timezone.utc,
+    "Z": timezone.utc,
+    "+00:00": timezone.utc,
+    "+0000": timezone.utc,
+    "+09:00": _JST,
+    "+0900": _JST,
+}
+
+
+def _fast_parse_iso(s: str) -> datetime | None:
+    """
+    Google Timeline で使われる ISO 8601 形式を文字位置で直接パースする。
+    - 2012-10-24T09:00:00[.000][Z|+09:00|+0900]
+    想定外の形式は None を返す (呼び出し側で strptime にフォールバック)。
+    """
+    if len(s) < 19 or s[4] != "-" or s[7] != "-" or s[10] != "T" or s[13] != ":" or s[16] != ":":
+        return None
+    digits = s[0:4] + s[5:7] + s[8:10] + s[11:13] + s[14:16] + s[17:19]
+    if not (digits.isascii() and digits.isdigit()):
         return None
 
-    # --- rawSignals の position ---
-    if entry.get("_type") == "rawPosition":
-        # LatLng 文字列形式 ("31.589°, 130.551°")
-        if "LatLng" in entry:
-            coords = parse_latlng(entry["LatLng"])
-            if coords:
-                result["lat"], result["lon"] = coords
-        # lat/lng 数値形式 (別のエクスポート形式)
-        elif "lat" in entry or "latE7" in entry:
-            result["lat"] = entry.get("lat") or entry.get("latE7", 0) / 1e7
-            result["lon"] = entry.get("lng") or entry.get("lngE7", 0) / 1e7
-
-        if "lat" not in result:
+    pos = 19
+    microsecond = 0
+    if s[19:20] == ".":
+        pos = 20
+        while pos < len(s) and "0" <= s[pos] <= "9":
+            pos += 1
+        frac = s[20:pos]
+        if not 1 <= len(frac) <= 6 or pos == len(s):
+            # タイムゾーンなしの小数秒は従来どおり strptime 側で扱う
             return None
+        microsecond = int(frac.ljust(6, "0"))
+
+    offset = s[pos:]
+    try:
+        tz = _TZ.get(offset)
+        if tz is None:
+            if offset[0] not in "+-" or not (len(offset) == 5 or (len(offset) == 6 and offset[3] == ":")):
+                return None
+            tz = _TZ[offset] = _tz_from_offset(offset)
+        return datetime(
+            int(digits[0:4]), int(digits[4:6]), int(digits[6:8]),
+            int(digits[8:10]), int(digits[10:12]), int(digits[12:14]),
+            microsecond, tzinfo=tz,
+        )
+    except ValueError:
+        return None
 
-        result["timestamp"] = entry.get("timestamp")
-        result["accuracy"] = entry.get("accuracyMeters")
-        result["altitude"] = entry.get("altitudeMeters")
-        result["speed"] = entry.get("speedMetersPerSecond")
-        result["source"] = f"raw:{entry.get('source', '')}"
-        return result
-
-    # --- 新形式: visit ---
-    if "visit" in entry:
-        visit = entry["visit"]
-        top = visit.get("topCandidate", {})
-        place_loc = top.get("placeLocation", {})
-        latlng_str = place_loc.get("latLng", "")
-        coords = parse_latlng(latlng_str)
-        if coords:
-            result["lat"], result["lon"] = coords
-        result["timestamp"] = entry.get("startTime") or entry.get("endTime")
-        result["place_id"] = top.get("placeId", "")
-        result["place_name"] = top.get("placeLocation", {}).get("name", "")
-        result["semantic_type"] = top.get("semanticType", "")
-        result["accuracy"] = None
-        result["source"] = "visit"
-        return result if "lat" in result else None
-
-    # --- 新形式: activity (移動) ---
-    if "activity" in entry:
-        activity = entry["activity"]
-        start = activity.get("start", "")
-        end_point = activity.get("end", "")
-        # start地点を使う
-        if isinstance(start, str):
-            coords = parse_latlng(start)
-        elif isinstance(start, dict):
-            coords = parse_latlng(start.get("latLng", ""))
-        else:
-            coords = None
-        if coords:
-            result["lat"], result["lon"] = coords
-        result["timestamp"] = entry.get("startTime")
-        result["activity_type"] = activity.get("topCandidate", {}).get("type", "")
-        result["accuracy"] = None
-        result["source"] = "activity"
-        return result if "lat" in result else None
-
-    # --- 新形式: timelinePoint ---
-    if "timelinePoint" in entry:
-        tp = entry["timelinePoint"]
-        result["lat"] = tp.get("latE7", 0) / 1e7 if "latE7" in tp else tp.get("lat")
-        result["lon"] = tp.get("lngE7", 0) / 1e7 if "lngE7" in tp else tp.get("lng")
-        result["timestamp"] = tp.get("timestamp")
-        result["accuracy"] = tp.get("accuracy")
-        result["source"] = "timelinePoint"
-        return result if result.get("lat") else None
 
-    return None
+# 日付 "YYYY-MM-DD" → その日の0時 (UTC) のエポック秒
+_DAY_SECONDS = {}
+# タイムゾーン表記 → (UTCからのオフセット秒, "%z" 形式の文字列)
+_UTC_OFFSETS = {}
+
+
+def _utc_offset(offset: str) -> tuple[int, str] | None:
+    """タイムゾーン表記をオフセット秒と "+0900" 形式の文字列にする (初出時に計算して登録)"""
+    tz = _TZ.get(offset)
+    if tz is None:
+        if offset[:1] not in ("+", "-") or not (len(offset) == 5 or (len(offset) == 6 and offset[3] == ":")):
+            return None
+        try:
+            tz = _tz_from_offset(offset)
+        except ValueError:
+            return None
+    seconds = int(tz.utcoffset(None).total_seconds())
+    hours, minutes = divmod(abs(seconds) // 60, 60)
+    entry = _UTC_OFFSETS[offset] = (seconds, f"{'-' if seconds < 0 else '+'}{hours:02d}{minutes:02d}")
+    return entry
+
+
+def _fast_parse_iso_to_ns(s: str) -> int | None:
+    """
+    _fast_parse_iso と同じ形式を、datetime を作らずにUNIXエポックからのナノ秒に変換する。
+    日付・タイムゾーンごとの計算結果はキャッシュする。
+    想定外の形式は None を返す。
+    """
+    if len(s) < 19 or s[4] != "-" or s[7] != "-" or s[10] != "T" or s[13] != ":" or s[16] != ":":
+        return None
+    if s[0] == "0":
+        # 1000年より前は strftime の %Y がゼロ埋めしないので datetime 側で扱う
+        return None
+    clock = s[11:13] + s[14:16] + s[17:19]
+    if not (clock.isascii() and clock.isdigit()):
+        return None
+    hour, minute, second = int(clock[0:2]), int(clock[2:4]), int(clock[4:6])
+    if hour > 23 or minute > 59 or second > 59:
+        return None
+
+    day = _DAY_SECONDS.get(s[:10])
+    if day is None:
+        digits = s[0:4] + s[5:7] + s[8:10]
+        if not (digits.isascii() and digits.isdigit()):
+            return None
+        try:
+            midnight = datetime(int(digits[0:4]), int(digits[4:6]), int(digits[6:8]), tzinfo=timezone.utc)
+        except ValueError:
+            return None
+        day = _DAY_SECONDS[s[:10]] = (midnight - _EPOCH) // _ONE_SECOND
+
+    pos = 19
+    microsecond = 0
+    if s[19:20] == ".":
+        pos = 20
+        while pos < len(s) and "0" <= s[pos] <= "9":
+            pos += 1
+        frac = s[20:pos]
+        if not 1 <= len(frac) <= 6 or pos == len(s):
+            return None
+        microsecond = int(frac.ljust(6, "0"))
+
+    offset = _UTC_OFFSETS.get(s[pos:]) or _utc_offset(s[pos:])
+    if offset is None:
+        return None
+    ns = ((day + hour * 3600 + minute * 60 + second - offset[0]) * 1_000_000 + microsecond) * 1000
+    return min(max(ns, NO_TIMESTAMP_NS + 1), MAX_TIMESTAMP_NS)
 
 
 def parse_timestamp(ts) -> datetime | None:
@@ -237,8 +665,12 @@ def parse_timestamp(ts) -> datetime | None:
             ts = ts / 1000
         return datetime.fromtimestamp(ts, tz=timezone.utc)
     if isinstance(ts, str):
+        dt = _fast_parse_iso(ts)
+        if dt is not None:
+            return dt
         # ISO 8601 (様々なバリエーション)
-        for fmt in [
+        # 数字だけの文字列 (timestampMs) はどの書式にも合わないので飛ばす
+        for fmt in [] if ts.isdigit() else [
             "%Y-%m-%dT%H:%M:%S.%f%z",    # 2012-10-24T09:00:00.000+09:00
             "%Y-%m-%dT%H:%M:%S%z",        # 2012-10-24T09:00:00+09:00
             "%Y-%m-%dT%H:%M:%S.%fZ",      # 2012-10-24T09:00:00.000Z
@@ -300,102 +732,319 @@ def cmd_peek(args):
         print(f"💡 500MB超のため、構造確認は先頭4KBのみ表示しています。")
 
 
-def cmd_stats(args):
-    """統計情報を表示"""
-    data = load_json_streaming(args.file)
-    entries = find_location_entries(data)
-    print(f"\n📊 エントリ総数: {len(entries):,}")
+def _tally_columns(cols: dict[str, list], entry_types: Counter, year_counts: Counter, span: list) -> int:
+    """
+    列バッファのタイムスタンプとソースを集計してバッファを空にする。集計件数を返す。
+    span にはバッファごとの最古・最新のタイムスタンプを追加する。
+    """
+    timestamps = [ts for ts in map(parse_timestamp, cols["timestamp"]) if ts]
+    if timestamps:
+        year_counts.update(ts.year for ts in timestamps)
+        span.append(min(timestamps))
+        span.append(max(timestamps))
+    entry_types.update(cols["source"])
+
+    count = len(cols["source"])
+    for col in cols.values():
+        col.clear()
+    return count
 
-    if not entries:
-        print("エントリが見つかりませんでした。")
-        return
 
-    # サンプリングして統計
-    timestamps = []
+def collect_stats(entries) -> tuple[int, int, Counter, Counter, list]:
+    """エントリを集計して (パース成功数, 失敗数, エントリタイプ, 年別件数, 最古・最新の候補) を返す"""
     entry_types = Counter()
+    year_counts = Counter()
+    span = []
     parsed_count = 0
     failed_count = 0
+    cols = new_columns()
 
     for entry in entries:
-        point = extract_location_point(entry)
-        if point:
-            parsed_count += 1
-            ts = parse_timestamp(point.get("timestamp"))
-            if ts:
-                timestamps.append(ts)
-            entry_types[point.get("source", "unknown")] += 1
+        if extract_into(entry, cols):
+            if len(cols["source"]) >= BATCH_SIZE:
+                parsed_count += _tally_columns(cols, entry_types, year_counts, span)
         else:
             failed_count += 1
             # 未対応形式のキーを記録
             if isinstance(entry, dict):
                 entry_types[f"unparsed:{','.join(sorted(entry.keys())[:3])}"] += 1
 
+    parsed_count += _tally_columns(cols, entry_types, year_counts, span)
+    return parsed_count, failed_count, entry_types, year_counts, span
+
+
+def _stats_from_chunk(chunk_path: Path) -> tuple[int, int, Counter, Counter, list]:
+    """--from-chunks のワーカー: チャンク1つ分の集計"""
+    return collect_stats(iter_chunk_entries(chunk_path))
+
+
+def cmd_stats(args):
+    """統計情報を表示"""
+    parsed_count = 0
+    failed_count = 0
+    entry_types = Counter()
+    year_counts = Counter()
+    span = []
+
+    if args.from_chunks:
+        # チャンクごとにプロセスを分けて集計し、結果をまとめる
+        chunks = list_chunks(args.from_chunks)
+        with multiprocessing.Pool(os.cpu_count()) as pool:
+            print(f"📂 {len(chunks)} 個のチャンクを {os.cpu_count()} プロセスで集計中...")
+            results = list(pool.imap_unordered(_stats_from_chunk, chunks, chunksize=1))
+    else:
+        results = [collect_stats(iter_location_entries(args.file))]
+
+    for parsed, failed, types, years, chunk_span in results:
+        parsed_count += parsed
+        failed_count += failed
+        entry_types.update(types)
+        year_counts.update(years)
+        span.extend(chunk_span)
+
+    print(f"\n📊 エントリ総数: {parsed_count + failed_count:,}")
+
+    if not parsed_count and not failed_count:
+        print("エントリが見つかりませんでした。")
+        return
+
     print(f"✅ パース成功: {parsed_count:,}")
     print(f"⚠️  パース失敗: {failed_count:,}")
     print(f"\n📋 エントリタイプ:")
     for t, c in entry_types.most_common(10):
         print(f"   {t}: {c:,}")
 
-    if timestamps:
-        timestamps.sort()
+    if span:
+        oldest, newest = min(span), max(span)
         print(f"\n📅 期間:")
-        print(f"   最古: {timestamps[0].strftime('%Y-%m-%d %H:%M:%S UTC')}")
-        print(f"   最新: {timestamps[-1].strftime('%Y-%m-%d %H:%M:%S UTC')}")
-        print(f"   日数: {(timestamps[-1] - timestamps[0]).days:,} 日間")
+        print(f"   最古: {oldest.strftime('%Y-%m-%d %H:%M:%S UTC')}")
+        print(f"   最新: {newest.strftime('%Y-%m-%d %H:%M:%S UTC')}")
+        print(f"   日数: {(newest - oldest).days:,} 日間")
 
         # 年ごとの件数
-        year_counts = Counter(ts.year for ts in timestamps)
         print(f"\n📆 年別レコード数:")
         for year in sorted(year_counts.keys()):
             print(f"   {year}: {year_counts[year]:,}")
 
 
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+_ONE_SECOND = timedelta(seconds=1)
+_ONE_MICROSECOND = timedelta(microseconds=1)
+
+
+def datetime_to_ns(dt: datetime) -> int:
+    """datetimeをUNIXエポックからのナノ秒に変換 (int64に収まるよう丸める)"""
+    ns = (dt - _EPOCH) // _ONE_MICROSECOND * 1000
+    return min(max(ns, NO_TIMESTAMP_NS + 1), MAX_TIMESTAMP_NS)
+
+
+def filter_mask(ts_ns, after_ns, before_ns):
+    """
+    期間フィルタのマスクを返す。
+    ts_ns が NO_TIMESTAMP_NS の要素はフィルタせずに残す。
+    """
+    return (ts_ns == NO_TIMESTAMP_NS) | ((ts_ns >= after_ns) & (ts_ns < before_ns))
+
+
+def parse_timestamps_ns(raw: list) -> tuple[list, dict]:
+    """
+    タイムスタンプをまとめてUNIXエポックからのナノ秒に変換する (パースできなければ None)。
+    高速パスで読めなかったものは {位置: datetime} も返す (出力時の文字列化に使う)。
+    """
+    ns_list = []
+    slow = {}
+    for i, ts in enumerate(raw):
+        ns = _fast_parse_iso_to_ns(ts) if isinstance(ts, str) else None
+        if ns is None:
+            dt = parse_timestamp(ts)
+            if dt:
+                slow[i] = dt
+                ns = datetime_to_ns(dt)
+        ns_list.append(ns)
+    return ns_list, slow
+
+
+def format_timestamp(ts_raw, ns: int | None, dt: datetime | None) -> str:
+    """
+    parse_timestamps_ns の結果からCSV出力用の文字列 ("%Y-%m-%dT%H:%M:%S%z") を作る。
+    高速パスで読めたものは元の文字列の日時部分にオフセットを付けるだけ。
+    """
+    if ns is None:
+        return ""
+    if dt is not None:
+        return dt.strftime("%Y-%m-%dT%H:%M:%S%z")
+    return ts_raw[:19] + _UTC_OFFSETS[ts_raw[19:].lstrip(".0123456789")][1]
+
+
+def filter_indices(ns_list: list, after_ns: int, before_ns: int) -> list[int]:
+    """
+    期間フィルタを通る位置のリストを返す (タイムスタンプなしはフィルタせずに残す)。
+    NumPy があれば配列で一括処理する。
+    """
+    if HAS_NUMPY:
+        ts_ns = np.fromiter(
+            (NO_TIMESTAMP_NS if ns is None else ns for ns in ns_list),
+            dtype=np.int64, count=len(ns_list),
+        )
+        return np.flatnonzero(filter_mask(ts_ns, after_ns, before_ns)).tolist()
+    return [i for i, ns in enumerate(ns_list) if ns is None or after_ns <= ns < before_ns]
+
+
+def format_e7(v: int) -> str:
+    """
+    E7形式の整数座標を小数点以下7桁の文字列にする。
+    浮動小数点を経由しないので丸め誤差がなく、float の repr より速い。
+    """
+    if v < 0:
+        q, r = divmod(-v, 10_000_000)
+        return f"-{q}.{r:07d}"
+    q, r = divmod(v, 10_000_000)
+    return f"{q}.{r:07d}"
+
+
+def _flush_records_batch(entries_buf: list, write_rows, after_ns: int, before_ns: int) -> tuple[int, int]:
+    """
+    旧形式 (latitudeE7) のエントリをまとめて行にして write_rows に渡す。
+    緯度経度は E7 の整数のまま文字列にする。
+    戻り値は (出力件数, フィルタ除外件数)。
+    """
+    n = len(entries_buf)
+    if not n:
+        return 0, 0
+    raw = [e.get("timestamp") or e.get("timestampMs") for e in entries_buf]
+    ns_list, slow = parse_timestamps_ns(raw)
+    keep = filter_indices(ns_list, after_ns, before_ns)
+
+    rows = []
+    for i in keep:
+        entry = entries_buf[i]
+        rows.append((
+            format_timestamp(raw[i], ns_list[i], slow.get(i)),
+            format_e7(int(entry["latitudeE7"])),
+            format_e7(int(entry["longitudeE7"])),
+            entry.get("accuracy"),
+            entry.get("source", ""),
+            "", "", "", "", "",
+        ))
+
+    write_rows(rows)
+    entries_buf.clear()
+    return len(rows), n - len(keep)
+
+
+def _flush_columns(cols: dict[str, list], write_rows, after_ns: int, before_ns: int) -> tuple[int, int]:
+    """
+    列バッファをまとめて行にして write_rows に渡し、バッファを空にする。
+    戻り値は (出力件数, フィルタ除外件数)。
+    """
+    raw = cols["timestamp"]
+    n = len(raw)
+    if not n:
+        return 0, 0
+    ns_list, slow = parse_timestamps_ns(raw)
+    keep = filter_indices(ns_list, after_ns, before_ns)
+
+    # 文字列化はフィルタを通ったものだけ
+    columns = list(cols.values())
+    columns[0] = [format_timestamp(raw[i], ns_list[i], slow.get(i)) for i in keep]
+    if len(keep) < n:
+        for j in range(1, len(columns)):
+            col = columns[j]
+            columns[j] = [col[i] for i in keep]
+    write_rows(zip(*columns))
+
+    for col in cols.values():
+        col.clear()
+    return len(keep), n - len(keep)
+
+
+def write_entries(entries, write_rows, after_ns: int, before_ns: int) -> tuple[int, int]:
+    """
+    エントリをCSVの行に変換し、BATCH_SIZE 件ごとに write_rows に渡す。
+    戻り値は (出力件数, フィルタ除外件数)。
+    """
+    count = 0
+    skipped = 0
+    # 旧形式 (latitudeE7) は生のエントリのまま溜めて配列でまとめて変換する
+    records_buf = []
+    # それ以外の形式は列ごとのリストに溜めてまとめて変換する
+    cols = new_columns()
+
+    for entry in entries:
+        if "latitudeE7" in entry:
+            records_buf.append(entry)
+            if len(records_buf) >= BATCH_SIZE:
+                written, excluded = _flush_records_batch(records_buf, write_rows, after_ns, before_ns)
+                count += written
+                skipped += excluded
+        elif extract_into(entry, cols) and len(cols["timestamp"]) >= BATCH_SIZE:
+            written, excluded = _flush_columns(cols, write_rows, after_ns, before_ns)
+            count += written
+            skipped += excluded
+
+    for written, excluded in (
+        _flush_records_batch(records_buf, write_rows, after_ns, before_ns),
+        _flush_columns(cols, write_rows, after_ns, before_ns),
+    ):
+        count += written
+        skipped += excluded
+    return count, skipped
+
+
+def _csv_rows_from_chunk(task: tuple[Path, int, int]) -> tuple[list, int]:
+    """--from-chunks のワーカー: チャンク1つ分の (CSVの行, フィルタ除外件数)"""
+    chunk_path, after_ns, before_ns = task
+    rows = []
+    _, skipped = write_entries(iter_chunk_entries(chunk_path), rows.extend, after_ns, before_ns)
+    return rows, skipped
+
+
+def imap_bounded(pool, func, tasks, window: int):
+    """
+    pool.imap と同じくタスクの順序で結果を返すが、投入済みで未回収のタスクを window 個までに抑える。
+    書き出し側が追いつかなくても、ワーカーの結果が親プロセスに溜まり続けない。
+    """
+    in_flight = deque()
+    for task in tasks:
+        if len(in_flight) >= window:
+            yield in_flight.popleft().get()
+        in_flight.append(pool.apply_async(func, (task,)))
+    while in_flight:
+        yield in_flight.popleft().get()
+
+
 def cmd_to_csv(args):
     """CSVに変換（D1投入用）"""
-    data = load_json_streaming(args.file)
-    entries = find_location_entries(data)
-
     after_dt = datetime.strptime(args.after, "%Y-%m-%d").replace(tzinfo=timezone.utc) if args.after else None
     before_dt = datetime.strptime(args.before, "%Y-%m-%d").replace(tzinfo=timezone.utc) if args.before else None
+    # 期間フィルタはエポックからのナノ秒の整数で比較する
+    after_ns = datetime_to_ns(after_dt) if after_dt else NO_TIMESTAMP_NS
+    before_ns = datetime_to_ns(before_dt) if before_dt else MAX_TIMESTAMP_NS
 
     output = args.output or "locations.csv"
-    count = 0
-    skipped = 0
 
-    with open(output, "w", newline="", encoding="utf-8") as f:
+    # 大きめのバッファに溜めて、writerows のたびに細かい write が走らないようにする
+    with io.TextIOWrapper(
+        open(output, "wb", buffering=WRITE_BUFFER_BYTES), newline="", encoding="utf-8", write_through=False,
+    ) as f:
         writer = csv.writer(f)
-        writer.writerow(["timestamp", "lat", "lon", "accuracy", "source", "place_id", "semantic_type", "activity_type", "altitude", "speed"])
-
-        for entry in entries:
-            point = extract_location_point(entry)
-            if not point:
-                continue
-
-            ts = parse_timestamp(point.get("timestamp"))
-            if ts:
-                if after_dt and ts < after_dt:
-                    skipped += 1
-                    continue
-                if before_dt and ts >= before_dt:
-                    skipped += 1
-                    continue
-                ts_str = ts.strftime("%Y-%m-%dT%H:%M:%S%z")
-            else:
-                ts_str = ""
-
-            writer.writerow([
-                ts_str,
-                point.get("lat", ""),
-                point.get("lon", ""),
-                point.get("accuracy", ""),
-                point.get("source", ""),
-                point.get("place_id", ""),
-                point.get("semantic_type", ""),
-                point.get("activity_type", ""),
-                point.get("altitude", ""),
-                point.get("speed", ""),
-            ])
-            count += 1
+        writer.writerow(CSV_COLUMNS)
+
+        if args.from_chunks:
+            # チャンクごとにプロセスを分けて変換し、書き出しはこのプロセスでまとめて行う
+            tasks = [(path, after_ns, before_ns) for path in list_chunks(args.from_chunks)]
+            count = 0
+            skipped = 0
+            processes = os.cpu_count()
+            with multiprocessing.Pool(processes) as pool:
+                print(f"📂 {len(tasks)} 個のチャンクを {processes} プロセスで変換中...")
+                # チャンクの順序のまま出力する。同時に抱えるチャンクはプロセス数の2倍まで
+                for rows, excluded in imap_bounded(pool, _csv_rows_from_chunk, tasks, 2 * processes):
+                    writer.writerows(rows)
+                    count += len(rows)
+                    skipped += excluded
+        else:
+            count, skipped = write_entries(iter_location_entries(args.file), writer.writerows, after_ns, before_ns)
 
     print(f"\n✅ {count:,} レコードを {output} に出力しました。")
     if skipped:
@@ -403,52 +1052,326 @@ def cmd_to_csv(args):
     print(f"📏 ファイルサイズ: {os.path.getsize(output) / (1024*1024):.1f} MB")
 
 
+# split でファイルをまとめて走査するブロックサイズ
+SCAN_BLOCK_BYTES = 8 * 1024 * 1024
+
+if HAS_NUMPY:
+    # 構造文字ごとの深さの増減 ({ [ は +1、} ] は -1)
+    _DEPTH_DELTA = np.zeros(256, dtype=np.int8)
+    _DEPTH_DELTA[[ord("{"), ord("[")]] = 1
+    _DEPTH_DELTA[[ord("}"), ord("]")]] = -1
+    # 走査対象の構造文字 ({ } [ ] ,)
+    _IS_STRUCTURAL = _DEPTH_DELTA != 0
+    _IS_STRUCTURAL[ord(",")] = True
+
+
+def _scan_structure(buf, max_depth: int):
+    """
+    JSONのバイト列から、文字列の外にある構造文字 ({ } [ ] ,) を
+    (位置, 文字, その文字の直後の深さ) の順で返す。
+    ブロックごとにNumPyでまとめて判定し、深さが max_depth 以下のものだけをPythonに渡す。
+    (閉じ括弧は max_depth 未満に戻るものだけ)
+    括弧の対応が崩れている・途中で終わっている場合は ValueError。
+    """
+    in_string = 0     # ブロック先頭が文字列の中かどうか
+    backslashes = 0   # 前のブロック末尾に続いていたバックスラッシュの数
+    depth = 0
+
+    for base in range(0, len(buf), SCAN_BLOCK_BYTES):
+        block = np.frombuffer(buf, dtype=np.uint8, count=min(SCAN_BLOCK_BYTES, len(buf) - base), offset=base)
+        n = len(block)
+
+        # 引用符のうち、直前のバックスラッシュが偶数個のものが文字列の開始・終了
+        quotes = np.flatnonzero(block == 0x22)
+        is_backslash = block == 0x5C
+        if is_backslash.any():
+            positions = np.arange(n, dtype=np.int64)
+            last_other = np.maximum.accumulate(np.where(is_backslash, -1, positions))
+            prev = quotes - 1
+            before = np.where(prev >= 0, last_other[np.maximum(prev, 0)], -1)
+            run = prev - before + np.where(before < 0, backslashes, 0)
+            quotes = quotes[(run & 1) == 0]
+            backslashes = n - 1 - last_other[-1] + (backslashes if last_other[-1] < 0 else 0)
+        else:
+            if backslashes % 2 and len(quotes) and quotes[0] == 0:
+                quotes = quotes[1:]
+            backslashes = 0
+
+        # 構造文字の前にある引用符の数の偶奇で、文字列の中にあるものを除く
+        candidates = np.flatnonzero(_IS_STRUCTURAL[block])
+        outside = ((np.searchsorted(quotes, candidates) + in_string) & 1) == 0
+        positions = candidates[outside]
+        chars = block[positions]
+        depths = depth + np.cumsum(_DEPTH_DELTA[chars], dtype=np.int64)
+        if len(depths):
+            if depths.min() < 0:
+                bad = base + int(positions[np.argmax(depths < 0)])
+                del block  # mmap を閉じられるようにビューを手放してから送出する
+                raise ValueError(f"unbalanced closing bracket at byte {bad:,}")
+            depth = int(depths[-1])
+        in_string = (in_string + len(quotes)) & 1
+
+        keep = (depths <= max_depth) & ~((depths == max_depth) & (_DEPTH_DELTA[chars] < 0))
+        yield from zip((positions[keep] + base).tolist(), chars[keep].tolist(), depths[keep].tolist())
+
+    if in_string or depth:
+        # ダウンロードが途中で切れたファイルなど
+        del block
+        raise ValueError(f"unexpected end of JSON after {len(buf):,} bytes (truncated file?)")
+
+
+def _key_before(buf, pos: int) -> str:
+    """位置 pos の値に対応するオブジェクトのキー ("key": の部分) をデコードする"""
+    colon = buf.rfind(b":", 0, pos)
+    end = buf.rfind(b'"', 0, colon)
+    start = buf.rfind(b'"', 0, end)
+    return json.loads(buf[start:end + 1])
+
+
+def iter_raw_elements(filepath: str, top_keys: list):
+    """
+    トップレベル配列の各要素を、パースせずに元のバイト列のまま (キー, バイト列) で返す。
+    デコードするのはトップレベルのキーだけ。キーはトップレベルがリストの場合 None。
+    NumPyがない場合はパースしてエンコードし直す。
+    """
+    if not HAS_NUMPY:
+        for key, item in iter_top_level_items(filepath, top_keys):
+            yield key, encode_entry(item)
+        return
+
+    size_mb = os.path.getsize(filepath) / (1024 * 1024)
+    print(f"📁 ファイルサイズ: {size_mb:.1f} MB")
+    if size_mb == 0:
+        raise ValueError(f"empty JSON file: {filepath}")
+
+    with open(filepath, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        if hasattr(mmap, "MADV_SEQUENTIAL"):
+            mm.madvise(mmap.MADV_SEQUENTIAL)
+
+        # トップレベルがオブジェクトなら深さ2、リストなら深さ1の配列が対象
+        head = mm[:4096].lstrip()
+        if head[:1] not in (b"{", b"["):
+            raise ValueError(f"top level of JSON must be an object or a list: {head[:20]!r}")
+        array_depth = 2 if head[:1] == b"{" else 1
+
+        key = None
+        start = None  # 対象の配列の中にいる間、次の要素の開始位置
+        root_end = None  # トップレベルの閉じ括弧の位置
+        for pos, char, depth in _scan_structure(mm, array_depth):
+            if root_end is not None:
+                raise ValueError(f"extra data after top-level JSON value at byte {pos:,}")
+            if depth == 0:
+                root_end = pos
+            if start is not None:
+                if depth == array_depth:  # 要素の区切りのカンマ
+                    yield key, mm[start:pos].strip()
+                    start = pos + 1
+                elif depth < array_depth:  # 配列の終わり
+                    element = mm[start:pos].strip()
+                    if element:
+                        yield key, element
+                    start = None
+            elif depth == array_depth and char in (0x7B, 0x5B):  # { [
+                if array_depth == 2:
+                    key = _key_before(mm, pos)
+                    top_keys.append(key)
+                    if char != 0x5B or key not in LOCATION_KEYS:
+                        continue
+                start = pos + 1
+
+        if start is not None:
+            raise ValueError(f"unterminated top-level array {key!r}")
+        if root_end is not None and mm[root_end + 1:].strip():
+            raise ValueError(f"extra data after top-level JSON value at byte {root_end + 1:,}")
+
+
+def encode_entry(entry) -> bytes:
+    """エントリをUTF-8のJSONバイト列にエンコード"""
+    if HAS_ORJSON:
+        return orjson.dumps(entry)
+    return json.dumps(entry, ensure_ascii=False).encode("utf-8")
+
+
+def chunk_envelope(top_key: str) -> tuple[bytes, bytes]:
+    """チャンクファイルの外枠 {top_key: [ ... ]} の前後のバイト列"""
+    return b"{" + json.dumps(top_key).encode("utf-8") + b":[", b"]}"
+
+
+def write_chunk(chunk_path: Path, top_key: str, body: bytes) -> int:
+    """カンマ区切りのエンコード済みエントリを {top_key: [...]} で包んで書き出す。書いたバイト数を返す"""
+    head, tail = chunk_envelope(top_key)
+    with open(chunk_path, "wb") as f:
+        f.write(head)
+        f.write(body)
+        f.write(tail)
+    return len(head) + len(body) + len(tail)
+
+
+class ChunkWriter:
+    """
+    split のチャンクを書き出す。
+    要素をカンマ区切りで1つのバッファに溜め (チャンク間で使い回す)、書き出し後のサイズで分割を判定する。
+    """
+    suffix = ".json"
+
+    def __init__(self):
+        self.body = bytearray()
+        self.path = None
+        self.top_key = None
+        self.count = 0
+
+    def start(self, path: Path, top_key: str):
+        self.path = path
+        self.top_key = top_key
+        self.count = 0
+        self.envelope_size = sum(map(len, chunk_envelope(top_key)))
+
+    def fits(self, size: int, max_bytes: int) -> bool:
+        """size バイトの要素を追加しても max_bytes に収まるか"""
+        # 書き出し後のファイルサイズ (外枠 + 既存 + カンマ + 新規) で判定する
+        return self.envelope_size + len(self.body) + 1 + size <= max_bytes
+
+    def write(self, entry_bytes: bytes):
+        if self.count:
+            self.body += b","
+        self.body += entry_bytes
+        self.count += 1
+
+    def finish(self) -> int:
+        """チャンクを書き出して、書いたバイト数を返す"""
+        size = write_chunk(self.path, self.top_key, self.body)
+        self.body.clear()
+        self.count = 0
+        return size
+
+    def abort(self):
+        """書きかけのチャンクを捨てる"""
+        self.body.clear()
+        self.count = 0
+
+
+class GzipChunkWriter(ChunkWriter):
+    """
+    split のチャンクを gzip (compresslevel=1) で直接書き出す。
+    分割は圧縮後のサイズで判定する。圧縮済みの分はファイルの tell() で、
+    まだ圧縮器に渡していない・圧縮器に残っている分は圧縮前のサイズを上限として見積もる。
+    """
+    suffix = ".json.gz"
+
+    # GzipFile.write は1回ごとのオーバーヘッドが大きいので、この単位でまとめて渡す
+    GZIP_WRITE_BYTES = 64 * 1024
+    # sync flush・gzipトレーラー・非圧縮ブロックのヘッダ分の余裕
+    MARGIN_BYTES = 64
+
+    def start(self, path: Path, top_key: str):
+        self.path = path
+        self.top_key = top_key
+        self.count = 0
+        head, self.tail = chunk_envelope(top_key)
+        self.file = open(path, "wb")
+        self.gz = gzip.GzipFile(fileobj=self.file, mode="wb", compresslevel=1)
+        self.gz.write(head)
+        self.compressing = len(head)  # 前回の sync flush 以降に圧縮器に渡したバイト数
+
+    def _drain(self):
+        """バッファの中身を圧縮器に渡す"""
+        self.gz.write(self.body)
+        self.compressing += len(self.body)
+        self.body.clear()
+
+    def fits(self, size: int, max_bytes: int) -> bool:
+        # 未圧縮の分と新しい要素は、圧縮されなかった場合のサイズで見積もる
+        limit = max_bytes - self.MARGIN_BYTES - len(self.tail) - 1 - (size + (size >> 10))
+        pending = self.compressing + len(self.body)
+        if self.file.tell() + pending + (pending >> 10) <= limit:
+            return True
+        if pending:
+            # 上限に近づいたら圧縮器の中身を押し出して、実際の圧縮サイズで判定し直す
+            self._drain()
+            self.gz.flush(zlib.Z_SYNC_FLUSH)
+            self.compressing = 0
+        return self.file.tell() <= limit
+
+    def write(self, entry_bytes: bytes):
+        super().write(entry_bytes)
+        if len(self.body) >= self.GZIP_WRITE_BYTES:
+            self._drain()
+
+    def finish(self) -> int:
+        self._drain()
+        self.gz.write(self.tail)
+        self.gz.close()
+        size = self.file.tell()
+        self.file.close()
+        self.count = 0
+        return size
+
+    def abort(self):
+        if self.count:
+            self.file.close()
+        super().abort()
+
+
+def _replace_chunks(staging_dir: Path, output_dir: Path) -> int:
+    """
+    前回の split のチャンク (番号の大きいものや圧縮あり・なし違い) を消して、
+    作業ディレクトリのチャンクを出力ディレクトリに移す。消したチャンクの数を返す。
+    """
+    old_chunks = [path for paths in _chunk_files(output_dir) for path in paths]
+    for path in old_chunks:
+        path.unlink()
+    for path in sorted(staging_dir.iterdir()):
+        os.replace(path, output_dir / path.name)
+    staging_dir.rmdir()
+    return len(old_chunks)
+
+
 def cmd_split(args):
     """JSONファイルを分割（Dawarich等のインポート制限対策）"""
-    data = load_json_streaming(args.file)
-    entries = find_location_entries(data)
-
     output_dir = Path(args.output or "chunks")
     output_dir.mkdir(parents=True, exist_ok=True)
+    # 同じファイルシステム上の作業ディレクトリに書き、最後まで分割できてから出力先に移す
+    staging_dir = Path(tempfile.mkdtemp(prefix=f".{output_dir.resolve().name}.", dir=output_dir.resolve().parent))
     max_bytes = (args.max_mb or 4) * 1024 * 1024
 
-    # 元のトップレベルキーを特定
-    top_key = "locations"  # デフォルト
-    if isinstance(data, dict):
-        for k in ["locations", "semanticSegments", "timelineObjects", "Records"]:
-            if k in data:
-                top_key = k
-                break
-
+    writer = GzipChunkWriter() if args.gzip else ChunkWriter()
+    top_keys = []
     chunk_idx = 0
-    current_chunk = []
-    current_size = 0
 
-    for entry in entries:
-        entry_json = json.dumps(entry, ensure_ascii=False)
-        entry_size = len(entry_json.encode("utf-8"))
-
-        if current_size + entry_size > max_bytes and current_chunk:
-            # チャンクを書き出し
-            chunk_path = output_dir / f"chunk_{chunk_idx:04d}.json"
-            with open(chunk_path, "w", encoding="utf-8") as f:
-                json.dump({top_key: current_chunk}, f, ensure_ascii=False)
-            print(f"   📄 {chunk_path.name}: {len(current_chunk):,} entries ({current_size / (1024*1024):.1f} MB)")
-            chunk_idx += 1
-            current_chunk = []
-            current_size = 0
-
-        current_chunk.append(entry)
-        current_size += entry_size
-
-    # 残り
-    if current_chunk:
-        chunk_path = output_dir / f"chunk_{chunk_idx:04d}.json"
-        with open(chunk_path, "w", encoding="utf-8") as f:
-            json.dump({top_key: current_chunk}, f, ensure_ascii=False)
-        print(f"   📄 {chunk_path.name}: {len(current_chunk):,} entries ({current_size / (1024*1024):.1f} MB)")
+    def flush():
+        nonlocal chunk_idx
+        count = writer.count
+        size = writer.finish()
+        print(f"   📄 {writer.path.name}: {count:,} entries ({size / (1024*1024):.1f} MB)")
         chunk_idx += 1
 
+    try:
+        for key, entry_bytes in iter_raw_elements(args.file, top_keys):
+            # 元のトップレベルキーをそのままチャンクのキーにする (リストの場合は locations)
+            key = key or "locations"
+            # 別の配列に移ったとき・サイズを超えるときはチャンクを分ける
+            if writer.count and (key != writer.top_key or not writer.fits(len(entry_bytes), max_bytes)):
+                flush()
+            if not writer.count:
+                writer.start(staging_dir / f"chunk_{chunk_idx:04d}{writer.suffix}", key)
+            writer.write(entry_bytes)
+
+        # 残り
+        if writer.count:
+            flush()
+    except BaseException:
+        # 途中で切れたファイルなどでは、それまでに書いたチャンクも残さない
+        writer.abort()
+        shutil.rmtree(staging_dir, ignore_errors=True)
+        print(f"\n❌ 分割を中止しました。{output_dir}/ は変更していません。")
+        raise
+
+    if not chunk_idx and top_keys:
+        warn_unknown_structure(top_keys)
+
+    removed = _replace_chunks(staging_dir, output_dir)
+    if removed:
+        print(f"🧹 {output_dir}/ の古いチャンク {removed} 個を置き換えました")
     print(f"\n✅ {chunk_idx} 個のチャンクに分割しました → {output_dir}/")
 
 
@@ -468,11 +1391,13 @@ def main():
 
     # stats
     p_stats = sub.add_parser("stats", help="統計情報を表示")
-    p_stats.add_argument("file", help="JSONファイルパス")
+    p_stats.add_argument("file", nargs="?", help="JSONファイルパス")
+    p_stats.add_argument("--from-chunks", metavar="DIR", help="split で作ったチャンクを並列に処理する")
 
     # to_csv
     p_csv = sub.add_parser("to_csv", help="CSVに変換")
-    p_csv.add_argument("file", help="JSONファイルパス")
+    p_csv.add_argument("file", nargs="?", help="JSONファイルパス")
+    p_csv.add_argument("--from-chunks", metavar="DIR", help="split で作ったチャンクを並列に処理する")
     p_csv.add_argument("-o", "--output", help="出力ファイル名 (default: locations.csv)")
     p_csv.add_argument("--after", help="この日付以降のみ (YYYY-MM-DD)")
     p_csv.add_argument("--before", help="この日付より前のみ (YYYY-MM-DD)")
@@ -482,12 +1407,15 @@ def main():
     p_split.add_argument("file", help="JSONファイルパス")
     p_split.add_argument("-o", "--output", help="出力ディレクトリ (default: chunks/)")
     p_split.add_argument("--max-mb", type=int, default=4, help="チャンクの最大サイズ MB (default: 4)")
+    p_split.add_argument("--gzip", action="store_true", help="chunk_XXXX.json.gz に圧縮して書き出す (サイズは圧縮後で判定)")
 
     args = parser.parse_args()
 
     if not args.command:
         parser.print_help()
         sys.exit(1)
+    if args.command in ("stats", "to_csv") and not (args.file or args.from_chunks):
+        parser.error("JSONファイルパスか --from-chunks DIR を指定してください")
 
     {"peek": cmd_peek, "stats": cmd_stats, "to_csv": cmd_to_csv, "split": cmd_split}[args.command](args)
 
@@ -11,7 +11,7 @@ D1のバッチ制限を考慮し、チャンク単位で送信する。
   python import_to_api.py locations.csv \
       --api-url https://location-sync-api.kiakiraki.workers.dev \
       --token YOUR_API_TOKEN \
-      --chunk-size 500
+      --chunk-size 500 --concurrency 8 --rate 8
 
   # ドライラン（送信せずJSONファイルに出力）
   python import_to_api.py locations.csv --dry-run -o chunks/
@@ -21,45 +21,149 @@ import argparse
 import csv
 import json
 import sys
+import threading
 import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 
 try:
     import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
     HAS_REQUESTS = True
 except ImportError:
     HAS_REQUESTS = False
 
+try:
+    import orjson
+    HAS_ORJSON = True
+except ImportError:
+    HAS_ORJSON = False
+
+# チャンクごとのTCP/TLSハンドシェイクを避けるため、接続を使い回すセッション
+_SESSION = None
+if HAS_REQUESTS:
+    _SESSION = requests.Session()
+    _SESSION.headers.update({"Content-Type": "application/json"})
+
+# リトライ対象のHTTPステータス
+# バッチ投入は重複を弾けない INSERT なので、サーバーが処理していないことが確かなものだけ
+RETRY_STATUSES = {429, 503}
+
+
+def configure_session(pool_size: int, retries: int):
+    """
+    並列数に合わせてセッションの接続プールを広げ、
+    429/503・接続エラーの再試行 (指数バックオフ、Retry-After 尊重) を設定する。
+    送信後の読み取りタイムアウト等はサーバーが登録済みかもしれないので再試行しない。
+    """
+    if HAS_REQUESTS:
+        retry = Retry(
+            total=retries,
+            read=0,  # 送信済みのリクエストは再送しない
+            backoff_factor=1.5,
+            status_forcelist=sorted(RETRY_STATUSES),
+            allowed_methods=None,  # POST も再試行する
+            raise_on_status=False,  # 最終的なレスポンスは raise_for_status で判定
+        )
+        adapter = HTTPAdapter(max_retries=retry, pool_connections=pool_size, pool_maxsize=pool_size)
+        _SESSION.mount("https://", adapter)
+        _SESSION.mount("http://", adapter)
+
+
+class RateLimiter:
+    """
+    トークンバケット方式のレート制限。
+    バックグラウンドスレッドが rate 件/秒でトークンを補充し、最大 burst 件まで溜める。
+    """
+
+    def __init__(self, rate: float, burst: int):
+        self._tokens = threading.BoundedSemaphore(burst)
+        self._interval = 1.0 / rate
+        self._stopped = threading.Event()
+        threading.Thread(target=self._refill, daemon=True).start()
+
+    def _refill(self):
+        while not self._stopped.wait(self._interval):
+            try:
+                self._tokens.release()
+            except ValueError:
+                pass  # バケットが満杯
+
+    def acquire(self):
+        self._tokens.acquire()
+
+    def stop(self):
+        self._stopped.set()
+
+
+# API に送るフィールド (CSVの列名と同じ)
+COLUMNS = ("timestamp", "lat", "lon", "accuracy", "source",
+           "place_id", "semantic_type", "activity_type", "altitude", "speed")
+
+
+def parse_csv(filepath: str) -> dict[str, list]:
+    """
+    CSVを列ごとのリスト (SoA) に読み込む。
+    行ごとのdictは作らず、送信直前に build_chunk でまとめて組み立てる。
+    """
+    columns = {name: [] for name in COLUMNS}
+    (timestamps, lats, lons, accuracies, sources,
+     place_ids, semantic_types, activity_types, altitudes, speeds) = columns.values()
 
-def parse_csv(filepath: str) -> list[dict]:
-    """CSVを読み込んでdictリストに変換"""
-    records = []
     with open(filepath, "r", encoding="utf-8") as f:
-        reader = csv.DictReader(f)
+        reader = csv.reader(f)
+        header = next(reader, [])
+        width = len(header)
+        # CSVにない列は、各行の末尾に足す空セルを指す
+        index = {name: i for i, name in enumerate(header)}
+        (i_ts, i_lat, i_lon, i_acc, i_src,
+         i_place, i_sem, i_act, i_alt, i_spd) = (index.get(name, width) for name in COLUMNS)
+
         for row in reader:
-            record = {
-                "timestamp": row.get("timestamp") or None,
-                "lat": float(row["lat"]) if row.get("lat") else None,
-                "lon": float(row["lon"]) if row.get("lon") else None,
-                "accuracy": float(row["accuracy"]) if row.get("accuracy") else None,
-                "source": row.get("source") or None,
-                "place_id": row.get("place_id") or None,
-                "semantic_type": row.get("semantic_type") or None,
-                "activity_type": row.get("activity_type") or None,
-                "altitude": float(row["altitude"]) if row.get("altitude") else None,
-                "speed": float(row["speed"]) if row.get("speed") else None,
-            }
-            if record["lat"] is not None and record["lon"] is not None:
-                records.append(record)
-    return records
+            # ヘッダより多いセルは捨て、足りない分と末尾の1つを空セルで埋める
+            del row[width:]
+            row.extend([""] * (width + 1 - len(row)))
+            lat = row[i_lat]
+            lon = row[i_lon]
+            if not lat or not lon:
+                continue
+            timestamps.append(row[i_ts] or None)
+            lats.append(float(lat))
+            lons.append(float(lon))
+            accuracies.append(float(row[i_acc]) if row[i_acc] else None)
+            sources.append(row[i_src] or None)
+            place_ids.append(row[i_place] or None)
+            semantic_types.append(row[i_sem] or None)
+            activity_types.append(row[i_act] or None)
+            altitudes.append(float(row[i_alt]) if row[i_alt] else None)
+            speeds.append(float(row[i_spd]) if row[i_spd] else None)
+
+    return columns
+
+
+def build_chunk(columns: dict[str, list], start: int, end: int) -> list[dict]:
+    """列データの [start, end) をAPI送信用のdictリストに変換"""
+    return [
+        dict(zip(COLUMNS, values))
+        for values in zip(*(columns[name][start:end] for name in COLUMNS))
+    ]
+
+
+def encode_payload(locations: list[dict]) -> bytes:
+    """{"locations": [...]} をJSONのバイト列にエンコード (orjsonがあれば使う)"""
+    if HAS_ORJSON:
+        return orjson.dumps({"locations": locations})
+    return json.dumps({"locations": locations}, ensure_ascii=False).encode("utf-8")
 
 
 def send_batch(api_url: str, token: str, locations: list[dict], chunk_idx: int) -> dict:
     """APIにバッチ送信"""
+    data = encode_payload(locations)
     if not HAS_REQUESTS:
         # requestsがない場合はurllibで代替
-        import urllib.request
-        data = json.dumps({"locations": locations}).encode("utf-8")
         req = urllib.request.Request(
             f"{api_url}/locations/batch",
             data=data,
@@ -72,9 +176,9 @@ def send_batch(api_url: str, token: str, locations: list[dict], chunk_idx: int)
         with urllib.request.urlopen(req) as resp:
             return json.loads(resp.read().decode("utf-8"))
     else:
-        resp = requests.post(
+        resp = _SESSION.post(
             f"{api_url}/locations/batch",
-            json={"locations": locations},
+            data=data,
             headers={"Authorization": f"Bearer {token}"},
             timeout=60,
         )
@@ -82,6 +186,100 @@ def send_batch(api_url: str, token: str, locations: list[dict], chunk_idx: int)
         return resp.json()
 
 
+def is_retryable(e: Exception) -> bool:
+    """再送しても重複しない一時的なエラー (429/503・接続エラー) かどうか"""
+    if isinstance(e, urllib.error.HTTPError):
+        return e.code in RETRY_STATUSES
+    if isinstance(e, urllib.error.URLError):
+        return True
+    if HAS_REQUESTS:
+        if isinstance(e, requests.HTTPError):
+            return e.response is not None and e.response.status_code in RETRY_STATUSES
+        if isinstance(e, requests.ReadTimeout):
+            return False
+        if isinstance(e, (requests.ConnectionError, requests.ConnectTimeout)):
+            return True
+    return False
+
+
+def upload_chunk(api_url: str, token: str, columns: dict[str, list], start: int, end: int,
+                 chunk_idx: int, limiter: RateLimiter | None, retries: int) -> dict:
+    """
+    レート制限を守って1チャンクを送信。
+    requests ではセッションのアダプタが再試行するので、ここでの再試行は urllib 用。
+    """
+    locations = build_chunk(columns, start, end)
+    if HAS_REQUESTS:
+        retries = 0
+    for attempt in range(retries + 1):
+        if limiter:
+            limiter.acquire()
+        try:
+            return send_batch(api_url, token, locations, chunk_idx)
+        except Exception as e:
+            if attempt == retries or not is_retryable(e):
+                raise
+            time.sleep(1.5 * 2 ** attempt)
+
+
+class Checkpoint:
+    """
+    送信に成功したチャンクの番号をファイルに記録し、--resume で未送信のチャンクだけを送れるようにする。
+    並列送信では完了順が前後するので、成功したチャンクを1行ずつ追記する
+    (1行目は対象のCSV・チャンクサイズ)。途中で落ちても成功済みの分は残る。
+    """
+
+    def __init__(self, path: Path, csv_file: str, chunk_size: int):
+        self.path = path
+        self.key = {"csv": str(Path(csv_file).resolve()), "chunk_size": chunk_size}
+        self.done = set()
+        self._file = None
+        self._lock = threading.Lock()  # 送信スレッドから記録される
+
+    def load(self) -> set[int]:
+        """記録済みの成功チャンクを読み込む。別のCSV・チャンクサイズの記録は無視する"""
+        try:
+            lines = self.path.read_text(encoding="utf-8").splitlines()
+        except FileNotFoundError:
+            return self.done
+        try:
+            saved = json.loads(lines[0]) if lines else {}
+        except ValueError:
+            saved = {}
+        if not isinstance(saved, dict) or {k: saved.get(k) for k in self.key} != self.key:
+            print(f"⚠️  {self.path} は別のCSVまたはチャンクサイズの記録なので無視します")
+            return self.done
+        for line in lines[1:]:
+            # 書き込み途中で落ちた最終行は読み飛ばす
+            if line.isdigit():
+                self.done.add(int(line))
+        return self.done
+
+    def open(self):
+        """記録を書き始める。読み込んだ成功チャンクは引き継ぐ"""
+        self._file = open(self.path, "w", encoding="utf-8")
+        self._file.write(json.dumps(self.key) + "\n")
+        for chunk_idx in sorted(self.done):
+            self._file.write(f"{chunk_idx}\n")
+        self._file.flush()
+
+    def mark_done(self, chunk_idx: int):
+        """チャンクの成功をすぐにファイルへ追記する"""
+        with self._lock:
+            self.done.add(chunk_idx)
+            self._file.write(f"{chunk_idx}\n")
+            self._file.flush()
+
+    def close(self):
+        if self._file:
+            self._file.close()
+            self._file = None
+
+    def clear(self):
+        self.close()
+        self.path.unlink(missing_ok=True)
+
+
 def main():
     parser = argparse.ArgumentParser(description="CSV → location-sync API インポーター")
     parser.add_argument("csv_file", help="入力CSVファイル")
@@ -94,15 +292,32 @@ def main():
                         help="APIに送信せず、JSONファイルに出力")
     parser.add_argument("-o", "--output", default="chunks",
                         help="ドライラン時の出力ディレクトリ")
-    parser.add_argument("--delay", type=float, default=0.5,
-                        help="リクエスト間の待ち時間(秒) (default: 0.5)")
+    parser.add_argument("--concurrency", type=int, default=8,
+                        help="同時に送信するリクエスト数 (default: 8)")
+    parser.add_argument("--rate", type=float, default=8.0,
+                        help="1秒あたりの最大リクエスト数、0で無制限 (default: 8)")
+    parser.add_argument("--retries", type=int, default=3,
+                        help="429/503・接続エラー時の再試行回数 (default: 3)")
+    parser.add_argument("--delay", type=float,
+                        help="非推奨: リクエスト間の待ち時間(秒)。--concurrency 1 --rate 1/DELAY として扱う")
+    parser.add_argument("--resume", action="store_true",
+                        help="前回の実行で成功したチャンクを飛ばして再開")
+    parser.add_argument("--checkpoint", default=".import_ckpt",
+                        help="再開位置を記録するファイル (default: .import_ckpt)")
     args = parser.parse_args()
 
+    if args.delay is not None:
+        # 以前の逐次送信のオプションとの互換
+        args.concurrency = 1
+        args.rate = 1 / args.delay if args.delay > 0 else 0
+        print(f"⚠️  --delay は非推奨です。--concurrency 1 --rate {args.rate:g} として送信します。")
+
     print(f"📖 {args.csv_file} を読み込み中...")
-    records = parse_csv(args.csv_file)
-    print(f"✅ {len(records):,} レコード読み込み完了")
+    columns = parse_csv(args.csv_file)
+    total_records = len(columns["lat"])
+    print(f"✅ {total_records:,} レコード読み込み完了")
 
-    total_chunks = (len(records) + args.chunk_size - 1) // args.chunk_size
+    total_chunks = (total_records + args.chunk_size - 1) // args.chunk_size
     total_imported = 0
     total_errors = 0
 
@@ -111,12 +326,12 @@ def main():
         output_dir.mkdir(parents=True, exist_ok=True)
         print(f"\n🔍 ドライラン: {output_dir}/ にJSON出力")
 
-        for i in range(0, len(records), args.chunk_size):
-            chunk = records[i:i + args.chunk_size]
+        for i in range(0, total_records, args.chunk_size):
+            chunk = build_chunk(columns, i, i + args.chunk_size)
             chunk_idx = i // args.chunk_size
             chunk_path = output_dir / f"batch_{chunk_idx:04d}.json"
-            with open(chunk_path, "w", encoding="utf-8") as f:
-                json.dump({"locations": chunk}, f, ensure_ascii=False)
+            with open(chunk_path, "wb") as f:
+                f.write(encode_payload(chunk))
             print(f"   📄 {chunk_path.name}: {len(chunk)} records")
 
         print(f"\n✅ {total_chunks} 個のJSONファイルに出力完了")
@@ -136,31 +351,88 @@ def main():
     print(f"\n🚀 {total_chunks} チャンクに分けて送信します")
     print(f"   API: {args.api_url}")
     print(f"   チャンクサイズ: {args.chunk_size}")
+    print(f"   並列数: {args.concurrency}")
+
+    checkpoint = Checkpoint(Path(args.checkpoint), args.csv_file, args.chunk_size)
+    done_chunks = checkpoint.load() if args.resume else set()
+    pending = [idx for idx in range(total_chunks) if idx not in done_chunks]
+    if done_chunks:
+        print(f"   再開: {total_chunks - len(pending)} チャンク送信済み、残り {len(pending)} チャンク")
     print()
+    checkpoint.open()
 
-    for i in range(0, len(records), args.chunk_size):
-        chunk = records[i:i + args.chunk_size]
-        chunk_idx = i // args.chunk_size
+    configure_session(args.concurrency, args.retries)
+    limiter = RateLimiter(args.rate, args.concurrency) if args.rate > 0 else None
+    failed_chunks = 0
+    total_sent = 0
 
+    def record_success(future, chunk_idx):
+        # 完了した送信は中断時も含めて必ず記録されるよう、送信スレッド側で記録する
+        if not future.cancelled() and future.exception() is None:
+            checkpoint.mark_done(chunk_idx)
+
+    def report(future):
+        nonlocal total_imported, total_errors, failed_chunks
+        chunk_idx, chunk_len = futures.pop(future)
         try:
-            result = send_batch(args.api_url, args.token, chunk, chunk_idx)
+            result = future.result()
             imported = result.get("imported", 0)
             errors = result.get("errors", 0)
             total_imported += imported
             total_errors += errors
             print(f"   [{chunk_idx + 1}/{total_chunks}] ✅ {imported} imported, {errors} errors")
         except Exception as e:
-            total_errors += len(chunk)
+            total_errors += chunk_len
+            failed_chunks += 1
             print(f"   [{chunk_idx + 1}/{total_chunks}] ❌ Error: {e}")
 
-        if i + args.chunk_size < len(records):
-            time.sleep(args.delay)
+    interrupted = False
+    futures = {}
+    pool = ThreadPoolExecutor(max_workers=args.concurrency)
+    try:
+        for chunk_idx in pending:
+            i = chunk_idx * args.chunk_size
+            end = min(i + args.chunk_size, total_records)
+            future = pool.submit(upload_chunk, args.api_url, args.token, columns, i, end,
+                                 chunk_idx, limiter, args.retries)
+            future.add_done_callback(lambda f, idx=chunk_idx: record_success(f, idx))
+            futures[future] = (chunk_idx, end - i)
+            total_sent += end - i
+
+        for future in as_completed(list(futures)):
+            report(future)
+    except KeyboardInterrupt:
+        # 待ち行列のチャンクは送らず、送信中のものの完了だけ待つ
+        interrupted = True
+        print("\n⏹️  中断しました。送信中のチャンクの完了を待っています...")
+        pool.shutdown(wait=True, cancel_futures=True)
+        for future in list(futures):
+            if future.cancelled():
+                total_sent -= futures.pop(future)[1]
+            else:
+                report(future)
+    finally:
+        pool.shutdown(wait=True)
+
+    if limiter:
+        limiter.stop()
+
+    if interrupted or failed_chunks:
+        checkpoint.close()
+        if failed_chunks:
+            print(f"\n💡 {failed_chunks} チャンクが失敗しました。")
+        print(f"\n💡 --resume を付けて再実行すると、未送信・失敗したチャンクだけを送信します。")
+        print(f"   (送信済み: {len(checkpoint.done)}/{total_chunks} チャンク)")
+    else:
+        checkpoint.clear()
 
     print(f"\n{'='*50}")
     print(f"📊 インポート完了")
     print(f"   成功: {total_imported:,}")
     print(f"   失敗: {total_errors:,}")
-    print(f"   合計: {len(records):,}")
+    print(f"   合計: {total_sent:,}")
+    if interrupted:
+        sys.exit(130)
 
 
 if __name__ == "__main__":